@@ -1,6 +1,8 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
-from ase.calculators.calculator import Calculator
+from ase.calculators.calculator import Calculator, FileIOCalculator
 from ase.data import atomic_numbers
 from ase.utils import IOContext
 from ase.geometry import get_distances
@@ -12,7 +14,8 @@ class SimpleQMMM(Calculator):
 
     implemented_properties = ['energy', 'forces']
 
-    def __init__(self, selection, qmcalc, mmcalc1, mmcalc2, vacuum=None):
+    def __init__(self, selection, qmcalc, mmcalc1, mmcalc2, vacuum=None,
+                 parallel=False):
         """SimpleQMMM object.
 
         The energy is calculated as::
@@ -34,13 +37,32 @@ class SimpleQMMM(Calculator):
         vacuum: float or None
             Amount of vacuum to add around QM atoms.  Use None if QM
             calculator doesn't need a box.
+        parallel: bool
+            Run the three calculators concurrently in separate threads.
+            This requires three distinct, thread safe calculator objects.
+            Calculators that write files must each have their own
+            directory and label, or they will overwrite each other's
+            files.
 
         """
+        if parallel:
+            calcs = [qmcalc, mmcalc1, mmcalc2]
+            if len({id(calc) for calc in calcs}) < 3:
+                raise ValueError('parallel=True needs three distinct '
+                                 'calculator objects')
+            labels = [calc.label for calc in calcs
+                      if isinstance(calc, FileIOCalculator)]
+            if len(set(labels)) < len(labels):
+                raise ValueError('parallel=True needs a different '
+                                 'directory or label for each '
+                                 'file-based calculator')
+
         self.selection = selection
         self.qmcalc = qmcalc
         self.mmcalc1 = mmcalc1
         self.mmcalc2 = mmcalc2
         self.vacuum = vacuum
+        self.parallel = parallel
 
         self.qmatoms = None
         self.center = None
@@ -71,22 +93,32 @@ class SimpleQMMM(Calculator):
             self.qmatoms.positions += (self.center -
                                        self.qmatoms.positions.mean(axis=0))
 
-        energy = self.qmcalc.get_potential_energy(self.qmatoms)
-        qmforces = self.qmcalc.get_forces(self.qmatoms)
-        energy += self.mmcalc2.get_potential_energy(atoms)
-        forces = self.mmcalc2.get_forces(atoms)
+        jobs = [(self.qmcalc, self.qmatoms),
+                (self.mmcalc2, atoms),
+                (self.mmcalc1, self.qmatoms)]
+        if self.parallel:
+            with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+                futures = [executor.submit(_energy_and_forces, calc, a)
+                           for calc, a in jobs]
+                results = [future.result() for future in futures]
+        else:
+            results = [_energy_and_forces(calc, a) for calc, a in jobs]
+        (qmenergy, qmforces), (energy, forces), (mmenergy, mmforces) = results
 
         if self.vacuum:
             qmforces -= qmforces.mean(axis=0)
-        forces[self.selection] += qmforces
 
-        energy -= self.mmcalc1.get_potential_energy(self.qmatoms)
-        forces[self.selection] -= self.mmcalc1.get_forces(self.qmatoms)
+        energy += qmenergy - mmenergy
+        forces[self.selection] += qmforces - mmforces
 
         self.results['energy'] = energy
         self.results['forces'] = forces
 
 
+def _energy_and_forces(calc, atoms):
+    return calc.get_potential_energy(atoms), calc.get_forces(atoms)
+
+
 class EIQMMM(Calculator, IOContext):
     """Explicit interaction QMMM calculator."""
     implemented_properties = ['energy', 'forces']
@@ -133,9 +165,14 @@ class EIQMMM(Calculator, IOContext):
         self.qmatoms = None
         self.mmatoms = None
         self.mask = None
+        self.qmindices = None
+        self.mmindices = None
+        self.qmpositions = None
+        self.mmpositions = None
         self.center = None  # center of QM atoms in QM-box
 
-        self.output = self.openfile(output)
+        # No logging at all for output=None, rather than writing to devnull:
+        self.output = None if output is None else self.openfile(output)
 
         Calculator.__init__(self)
 
@@ -145,6 +182,11 @@ class EIQMMM(Calculator, IOContext):
     def initialize(self, atoms):
         self.mask = np.zeros(len(atoms), bool)
         self.mask[self.selection] = True
+        # Integer indices and buffers for gathering positions every step:
+        self.qmindices = np.flatnonzero(self.mask)
+        self.mmindices = np.flatnonzero(~self.mask)
+        self.qmpositions = np.empty((len(self.qmindices), 3))
+        self.mmpositions = np.empty((len(self.mmindices), 3))
 
         constraints = atoms.constraints
         atoms.constraints = []  # avoid slicing of constraints
@@ -157,8 +199,9 @@ class EIQMMM(Calculator, IOContext):
         if self.vacuum:
             self.qmatoms.center(vacuum=self.vacuum)
             self.center = self.qmatoms.positions.mean(axis=0)
-            print('Size of QM-cell after centering:',
-                  self.qmatoms.cell.diagonal(), file=self.output)
+            if self.output is not None:
+                print('Size of QM-cell after centering:',
+                      self.qmatoms.cell.diagonal(), file=self.output)
 
         self.qmatoms.calc = self.qmcalc
         self.mmatoms.calc = self.mmcalc
@@ -167,7 +210,8 @@ class EIQMMM(Calculator, IOContext):
             self.embedding = Embedding()
 
         self.embedding.initialize(self.qmatoms, self.mmatoms)
-        print('Embedding:', self.embedding, file=self.output)
+        if self.output is not None:
+            print('Embedding:', self.embedding, file=self.output)
 
     def calculate(self, atoms, properties, system_changes):
         Calculator.calculate(self, atoms, properties, system_changes)
@@ -175,8 +219,12 @@ class EIQMMM(Calculator, IOContext):
         if self.qmatoms is None:
             self.initialize(atoms)
 
-        self.mmatoms.set_positions(atoms.positions[~self.mask])
-        self.qmatoms.set_positions(atoms.positions[self.mask])
+        np.take(atoms.positions, self.mmindices, axis=0,
+                out=self.mmpositions)
+        np.take(atoms.positions, self.qmindices, axis=0,
+                out=self.qmpositions)
+        self.mmatoms.set_positions(self.mmpositions)
+        self.qmatoms.set_positions(self.qmpositions)
 
         if self.vacuum:
             shift = self.center - self.qmatoms.positions.mean(axis=0)
@@ -193,8 +241,10 @@ class EIQMMM(Calculator, IOContext):
         mmenergy = self.mmatoms.get_potential_energy()
         energy = ienergy + qmenergy + mmenergy
 
-        print('Energies: {0:12.3f} {1:+12.3f} {2:+12.3f} = {3:12.3f}'
-              .format(ienergy, qmenergy, mmenergy, energy), file=self.output)
+        if self.output is not None:
+            print('Energies: {0:12.3f} {1:+12.3f} {2:+12.3f} = {3:12.3f}'
+                  .format(ienergy, qmenergy, mmenergy, energy),
+                  file=self.output)
 
         qmforces = self.qmatoms.get_forces()
         mmforces = self.mmatoms.get_forces()
@@ -202,8 +252,8 @@ class EIQMMM(Calculator, IOContext):
         mmforces += self.embedding.get_mm_forces()
 
         forces = np.empty((len(atoms), 3))
-        forces[self.mask] = qmforces + iqmforces
-        forces[~self.mask] = mmforces + immforces
+        forces[self.qmindices] = qmforces + iqmforces
+        forces[self.mmindices] = mmforces + immforces
 
         self.results['energy'] = energy
         self.results['forces'] = forces
@@ -211,11 +261,35 @@ class EIQMMM(Calculator, IOContext):
 
 def wrap(D, cell, pbc):
     """Wrap distances to nearest neighbor (minimum image convention)."""
+    if pbc[0] and pbc[1] and pbc[2]:
+        # Usual case for MM systems: all axes in one go
+        D -= cell * np.rint(D / cell)  # modify D inplace
+        return
     for i, periodic in enumerate(pbc):
         if periodic:
             d = D[:, i]
             L = cell[i]
-            d[:] = (d + L / 2) % L - L / 2  # modify D inplace
+            d -= L * np.rint(d / L)  # modify D inplace
+
+
+def wrap_molecules(positions, center, cell, pbc):
+    """Move whole molecules to the periodic image closest to center.
+
+    positions has shape (nmol, atoms_per_mol, 3) and is modified inplace.
+    The image is chosen from the first atom of each molecule, so that
+    molecules are not ripped apart."""
+    # Distances from the center to the first atom of each molecule,
+    # turned into the offset of each molecule after wrapping:
+    offsets = positions[:, 0] - center
+    wrap(offsets, cell, pbc)
+    offsets -= positions[:, 0]
+    offsets += center
+    positions += offsets[:, np.newaxis]
+
+
+def _species_indices(numbers):
+    """Map each atomic number to the indices of the atoms having it."""
+    return {Z: np.flatnonzero(numbers == Z) for Z in np.unique(numbers)}
 
 
 class Embedding:
@@ -226,6 +300,7 @@ class Embedding:
         self.molecule_size = molecule_size
         self.virtual_molecule_size = None
         self.parameters = parameters
+        self.com_pv = {}  # per-site molecule centers, reused between steps
 
     def __repr__(self):
         return 'Embedding(molecule_size={0})'.format(self.molecule_size)
@@ -278,21 +353,18 @@ class Embedding:
         apm = (apm1, apm2)
         mask = (mask1, mask2)
         spm = (spm1, spm2)
-        for p, n, m, vn in zip(pos, apm, mask, spm):
+        for ii, (p, n, m, vn) in enumerate(zip(pos, apm, mask, spm)):
             positions = p.reshape((-1, n, 3)) + shift
-
-            # Distances from the center of the QM box to the first atom of
-            # each molecule:
-            distances = positions[:, 0] - qmcenter
-
-            wrap(distances, self.mmatoms.cell.diagonal(), self.mmatoms.pbc)
-            offsets = distances - positions[:, 0]
-            positions += offsets[:, np.newaxis] + qmcenter
+            wrap_molecules(positions, qmcenter,
+                           self.mmatoms.cell.diagonal(), self.mmatoms.pbc)
 
             # Geometric center positions for each mm mol for LR cut
-            com = np.array([p.mean(axis=0) for p in positions])
+            com = positions.mean(axis=1)
             # Need per atom for C-code:
-            com_pv = np.repeat(com, vn, axis=0)
+            com_pv = self.com_pv.get(ii)
+            if com_pv is None or len(com_pv) != len(com) * vn:
+                com_pv = self.com_pv[ii] = np.empty((len(com) * vn, 3))
+            com_pv.reshape((-1, vn, 3))[:] = com[:, np.newaxis]
             com_all.append(com_pv)
 
             wrap_pos[m] = positions.reshape((-1, 3))
@@ -329,29 +401,130 @@ def combine_lj_lorenz_berthelot(sigmaqm, sigmamm,
         numcalcs = 1  # if only 1 mm calc, eps and sig are simply np arrays
         sigmamm = (sigmamm, )
         epsilonmm = (epsilonmm, )
+    sigmaqm = np.asarray(sigmaqm, dtype=float)
+    epsilonqm = np.asarray(epsilonqm, dtype=float)
     for cc in range(numcalcs):
-        sigma_c = np.zeros((len(sigmaqm), len(sigmamm[cc])))
-        epsilon_c = np.zeros_like(sigma_c)
-
-        for ii in range(len(sigmaqm)):
-            sigma_c[ii, :] = (sigmaqm[ii] + sigmamm[cc]) / 2
-            epsilon_c[ii, :] = (epsilonqm[ii] * epsilonmm[cc])**0.5
+        sigma_c = 0.5 * (sigmaqm[:, None] + np.asarray(sigmamm[cc])[None, :])
+        epsilon_c = np.sqrt(epsilonqm[:, None] *
+                            np.asarray(epsilonmm[cc])[None, :])
         sigma.append(sigma_c)
         epsilon.append(epsilon_c)
 
     if numcalcs == 1:  # retain original, 1 calc function
-        sigma = np.array(sigma[0])
-        epsilon = np.array(epsilon[0])
+        sigma = sigma[0]
+        epsilon = epsilon[0]
 
     return sigma, epsilon
 
 
+def _lj_general_kernel(qmpositions, mmpositions, sigma6, epsilon, rc, width,
+                       maxpairs=2**16):
+    """LJ energy and forces between QM and MM molecules.
+
+    qmpositions and mmpositions have shape (nmol, atoms_per_mol, 3).
+    sigma6 and epsilon are the combined (apm_qm, apm_mm) tables, with
+    sigma6 = sigma**6.  The switching function is evaluated on the
+    distance between the first atoms of each pair of QM and MM
+    molecules.  Pair interactions are evaluated in the precision of the
+    sigma6 and epsilon tables, but the differences of the positions, the
+    energy and the force sums are always done in double precision.  The
+    QM atoms are processed in blocks of at most about maxpairs atom
+    pairs, which bounds temporary memory."""
+    qmforces = np.zeros(qmpositions.shape)
+    mmforces = np.zeros(mmpositions.shape)
+
+    # QM atoms without any LJ parameters do not interact:
+    active = np.flatnonzero(epsilon.any(1))
+    sig6 = sigma6[active, None, :]
+    eps = epsilon[active, None, :]
+
+    # All QM molecules at once.  Cutoff from first atom of each mol,
+    # shape (nqm_mol, nmm_mol):
+    R00 = mmpositions[:, 0] - qmpositions[:, None, 0]
+    d00 = np.sqrt(np.einsum('ijx,ijx->ij', R00, R00))
+    # Switching function in one pass: y is 0 inside rc - width and 1
+    # beyond rc, which gives t = 1, dt = 0 and t = 0, dt = 0 there:
+    y = np.clip((d00 - rc + width) / width, 0.0, 1.0)
+    t = 1.0 - y**2 * (3.0 - 2.0 * y)
+    dt = -6.0 / width * y * (1.0 - y)
+
+    # Drop MM molecules that are beyond the cutoff of all QM molecules:
+    inside = np.flatnonzero((t != 0.0).any(0))
+    t = t[:, inside]
+    dt = dt[:, inside]
+    R00 = R00[:, inside]
+    d00 = d00[:, inside]
+
+    mmpos = mmpositions[inside]
+    qmpos = qmpositions[:, active]
+    nqm, nqa = qmpos.shape[:2]
+    nmm, apm = mmpos.shape[:2]
+    mm = mmpos.reshape((-1, 3))
+
+    # Whole QM molecules per block if they fit, otherwise blocks of the
+    # atoms of a single QM molecule:
+    pairs = max(nqa * nmm * apm, 1)
+    if pairs <= maxpairs:
+        nmol = maxpairs // pairs
+        natoms = max(nqa, 1)
+    else:
+        nmol = 1
+        natoms = max(maxpairs // max(nmm * apm, 1), 1)
+
+    esum = np.zeros((nqm, nmm))  # unswitched energy per pair of molecules
+    fmm = np.zeros((nmm * apm, 3))
+    for i in range(0, nqm, nmol):
+        mols = slice(i, i + nmol)
+        for j in range(0, nqa, natoms):
+            atoms = slice(j, j + natoms)
+            # shape (nmol, natoms, nmm_inside, apm, 3)
+            qpos = qmpos[mols, atoms]
+            R = mmpos - qpos[:, :, None, None, :]
+            R = R.astype(sigma6.dtype, copy=False)
+            rinv2 = 1.0 / np.einsum('ijklx,ijklx->ijkl', R, R)
+            del R
+            c6 = rinv2 * rinv2
+            c6 *= rinv2
+            c6 *= sig6[atoms]
+            c12 = c6 * c6
+            e = c12 - c6
+            e *= 4 * eps[atoms]
+            esum[mols] += e.sum(3).sum(1)
+            del e
+            # Force magnitudes over distance, built inplace in the c12
+            # array:
+            f = c12
+            f *= 2
+            f -= c6
+            f *= 24 * eps[atoms]
+            f *= rinv2
+            f *= t[mols, None, :, None]
+
+            # As R = mmpos - qmpos, the force sums split into matrix
+            # products with the positions, so no (..., 3) force arrays
+            # are built.  These are done in double precision, as the
+            # split cancels digits:
+            f = f.reshape((-1, nmm * apm)).astype(float, copy=False)
+            qm = qpos.reshape((-1, 3))
+            fmm += f.sum(0)[:, None] * mm - f.T @ qm
+            qmforces[mols, active[atoms]] -= (
+                f @ mm - f.sum(1)[:, None] * qm).reshape(qpos.shape)
+
+    energy = (esum * t).sum(dtype=float)
+    f00 = -esum * dt / d00
+    mmforces[inside] = fmm.reshape(mmpos.shape)
+    mmforces[inside, 0] += np.einsum('ik,ikx->kx', f00, R00)
+    qmforces[:, 0] -= np.einsum('ik,ikx->ix', f00, R00)
+
+    return energy, qmforces, mmforces
+
+
 class LJInteractionsGeneral:
     name = 'LJ-general'
 
     def __init__(self, sigmaqm, epsilonqm, sigmamm, epsilonmm,
                  qm_molecule_size, mm_molecule_size=3,
-                 rc=np.Inf, width=1.0):
+                 rc=np.Inf, width=1.0, dtype=float):
         """General Lennard-Jones type explicit interaction.
 
         sigmaqm: array
@@ -377,6 +550,19 @@ class LJInteractionsGeneral:
             as qm_molecule_size but for the MM subsystem. Will be overwritten
             if counterions are present in the MM subsystem (via the CombineMM
             calculator)
+        rc: float
+            Cutoff for the switching function, measured between the first
+            atoms of the QM and MM molecules
+        width: float
+            Width of the switching region below rc
+        dtype: numpy dtype
+            Floating point type for the pair interactions.  np.float32
+            can be somewhat faster for large systems, at the cost of
+            precision.  Interatomic
+            vectors are taken from the double precision positions before
+            the cast, so the precision does not depend on the distance
+            from the origin.  Energies and forces are summed in double
+            precision.
 
         """
         self.sigmaqm = sigmaqm
@@ -387,100 +573,68 @@ class LJInteractionsGeneral:
         self.mms = mm_molecule_size
         self.rc = rc
         self.width = width
+        self.dtype = dtype
         self.combine_lj()
 
     def combine_lj(self):
         self.sigma, self.epsilon = combine_lj_lorenz_berthelot(
             self.sigmaqm, self.sigmamm, self.epsilonqm, self.epsilonmm)
+        # c6 = sigma**6 / d**6 is then evaluated without any powers:
+        if isinstance(self.sigma, list):
+            self.sigma6 = [sigma**6 for sigma in self.sigma]
+        else:
+            self.sigma6 = self.sigma**6
 
     def calculate(self, qmatoms, mmatoms, shift):
         epsilon = self.epsilon
-        sigma = self.sigma
+        sigma6 = self.sigma6
 
         # loop over possible multiple mm calculators
         # currently 1 or 2, but could be generalized in the future...
+        # Atoms of each MM group are selected through views or integer
+        # indices, not by slicing the Atoms object:
         apm1 = self.mms
-        mask1 = np.ones(len(mmatoms), dtype=bool)
+        mask1 = slice(None)
         mask2 = mask1
         apm = (apm1, )
-        sigma = (sigma, )
+        sigma6 = (sigma6, )
         epsilon = (epsilon, )
         if hasattr(mmatoms.calc, 'name'):
             if mmatoms.calc.name == 'combinemm':
-                mask1 = mmatoms.calc.mask
-                mask2 = ~mask1
+                mask1 = np.flatnonzero(mmatoms.calc.mask)
+                mask2 = np.flatnonzero(~mmatoms.calc.mask)
                 apm1 = mmatoms.calc.apm1
                 apm2 = mmatoms.calc.apm2
                 apm = (apm1, apm2)
-                sigma = sigma[0]  # Was already loopable 2-tuple
+                sigma6 = sigma6[0]  # Was already loopable 2-tuple
                 epsilon = epsilon[0]
 
         mask = (mask1, mask2)
         e_all = 0
         qmforces_all = np.zeros_like(qmatoms.positions)
         mmforces_all = np.zeros_like(mmatoms.positions)
+        qmpositions = qmatoms.positions.reshape((-1, self.qms, 3))
 
         # zip stops at shortest tuple so we dont double count
         # cases of no counter ions.
-        for n, m, eps, sig in zip(apm, mask, epsilon, sigma):
-            mmpositions = self.update(qmatoms, mmatoms[m], n, shift)
-            qmforces = np.zeros_like(qmatoms.positions)
-            mmforces = np.zeros_like(mmatoms[m].positions)
-            energy = 0.0
-
-            qmpositions = qmatoms.positions.reshape((-1, self.qms, 3))
-
-            for q, qmpos in enumerate(qmpositions):  # molwise loop
-                # cutoff from first atom of each mol
-                R00 = mmpositions[:, 0] - qmpos[0, :]
-                d002 = (R00**2).sum(1)
-                d00 = d002**0.5
-                x1 = d00 > self.rc - self.width
-                x2 = d00 < self.rc
-                x12 = np.logical_and(x1, x2)
-                y = (d00[x12] - self.rc + self.width) / self.width
-                t = np.zeros(len(d00))
-                t[x2] = 1.0
-                t[x12] -= y**2 * (3.0 - 2.0 * y)
-                dt = np.zeros(len(d00))
-                dt[x12] -= 6.0 / self.width * y * (1.0 - y)
-                for qa in range(len(qmpos)):
-                    if ~np.any(eps[qa, :]):
-                        continue
-                    R = mmpositions - qmpos[qa, :]
-                    d2 = (R**2).sum(2)
-                    c6 = (sig[qa, :]**2 / d2)**3
-                    c12 = c6**2
-                    e = 4 * eps[qa, :] * (c12 - c6)
-                    energy += np.dot(e.sum(1), t)
-                    f = t[:, None, None] * (24 * eps[qa, :] *
-                                            (2 * c12 - c6) / d2)[:, :, None] * R
-                    f00 = - (e.sum(1) * dt / d00)[:, None] * R00
-                    mmforces += f.reshape((-1, 3))
-                    qmforces[q * self.qms + qa, :] -= f.sum(0).sum(0)
-                    qmforces[q * self.qms, :] -= f00.sum(0)
-                    mmforces[::n, :] += f00
-
-                e_all += energy
-                qmforces_all += qmforces
-                mmforces_all[m] += mmforces
+        for n, m, eps, sig6 in zip(apm, mask, epsilon, sigma6):
+            mmpositions = self.update(qmatoms, mmatoms, n, shift, m)
+            energy, qmforces, mmforces = _lj_general_kernel(
+                qmpositions, mmpositions, sig6.astype(self.dtype, copy=False),
+                eps.astype(self.dtype, copy=False), self.rc, self.width)
+            e_all += energy
+            qmforces_all += qmforces.reshape((-1, 3))
+            mmforces_all[m] += mmforces.reshape((-1, 3))
 
         return e_all, qmforces_all, mmforces_all
 
-    def update(self, qmatoms, mmatoms, n, shift):
+    def update(self, qmatoms, mmatoms, n, shift, selection=slice(None)):
         # Wrap point-charge positions to the MM-cell closest to the
         # center of the the QM box, but avoid ripping molecules apart:
         qmcenter = qmatoms.cell.diagonal() / 2
-        positions = mmatoms.positions.reshape((-1, n, 3)) + shift
-
-        # Distances from the center of the QM box to the first atom of
-        # each molecule:
-        distances = positions[:, 0] - qmcenter
-
-        wrap(distances, mmatoms.cell.diagonal(), mmatoms.pbc)
-        offsets = distances - positions[:, 0]
-        positions += offsets[:, np.newaxis] + qmcenter
-
+        positions = mmatoms.positions[selection].reshape((-1, n, 3)) + shift
+        wrap_molecules(positions, qmcenter,
+                       mmatoms.cell.diagonal(), mmatoms.pbc)
         return positions
 
 
@@ -503,29 +657,49 @@ class LJInteractions:
         for (symbol1, symbol2), (epsilon, sigma) in parameters.items():
             Z1 = atomic_numbers[symbol1]
             Z2 = atomic_numbers[symbol2]
-            self.parameters[(Z1, Z2)] = epsilon, sigma
-            self.parameters[(Z2, Z1)] = epsilon, sigma
+            # sigma**6 is stored as well for the energy and force kernel:
+            self.parameters[(Z1, Z2)] = epsilon, sigma, sigma**6
+            self.parameters[(Z2, Z1)] = epsilon, sigma, sigma**6
+
+        self.numbers = None  # atomic numbers that self.pairs was made for
+        self.pairs = None
+
+    def get_pairs(self, qmatoms, mmatoms):
+        """Atom indices and parameters for each interacting species pair.
+
+        The pairs are cached until the atomic numbers change."""
+        numbers = (qmatoms.numbers, mmatoms.numbers)
+        if (self.numbers is None or
+                not all(map(np.array_equal, numbers, self.numbers))):
+            self.numbers = tuple(n.copy() for n in numbers)
+            qmindices = _species_indices(qmatoms.numbers)
+            mmindices = _species_indices(mmatoms.numbers)
+            self.pairs = [(i1, i2) + self.parameters[(Z1, Z2)]
+                          for Z1, i1 in qmindices.items()
+                          for Z2, i2 in mmindices.items()
+                          if (Z1, Z2) in self.parameters]
+        return self.pairs
 
     def calculate(self, qmatoms, mmatoms, shift):
         qmforces = np.zeros_like(qmatoms.positions)
         mmforces = np.zeros_like(mmatoms.positions)
-        species = set(mmatoms.numbers)
+        cell = mmatoms.cell.diagonal()
+        pbc = mmatoms.pbc
         energy = 0.0
-        for R1, Z1, F1 in zip(qmatoms.positions, qmatoms.numbers, qmforces):
-            for Z2 in species:
-                if (Z1, Z2) not in self.parameters:
-                    continue
-                epsilon, sigma = self.parameters[(Z1, Z2)]
-                mask = (mmatoms.numbers == Z2)
-                D = mmatoms.positions[mask] + shift - R1
-                wrap(D, mmatoms.cell.diagonal(), mmatoms.pbc)
-                d2 = (D**2).sum(1)
-                c6 = (sigma**2 / d2)**3
-                c12 = c6**2
-                energy += 4 * epsilon * (c12 - c6).sum()
-                f = 24 * epsilon * ((2 * c12 - c6) / d2)[:, np.newaxis] * D
-                F1 -= f.sum(0)
-                mmforces[mask] += f
+        for i1, i2, epsilon, sigma, sigma6 in self.get_pairs(qmatoms,
+                                                             mmatoms):
+            # All atoms of the species pair at once, shape (n1, n2, 3):
+            D = (mmatoms.positions[i2] + shift -
+                 qmatoms.positions[i1, np.newaxis])
+            wrap(D.reshape((-1, 3)), cell, pbc)
+            d2 = np.einsum('ijx,ijx->ij', D, D)
+            rinv2 = 1.0 / d2
+            c6 = sigma6 * (rinv2 * rinv2 * rinv2)
+            c12 = c6 * c6
+            energy += 4 * epsilon * (c12 - c6).sum()
+            f = (24 * epsilon * (2 * c12 - c6) * rinv2)[:, :, np.newaxis] * D
+            qmforces[i1] -= f.sum(1)
+            mmforces[i2] += f.sum(0)
         return energy, qmforces, mmforces
 
 
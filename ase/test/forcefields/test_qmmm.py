@@ -1,16 +1,240 @@
+from io import StringIO
 from math import cos, sin, pi
 
 import numpy as np
+import pytest
 
 import ase.units as units
 from ase import Atoms
+from ase.calculators.calculator import FileIOCalculator
 from ase.calculators.tip3p import TIP3P, epsilon0, sigma0, rOH, angleHOH
 from ase.calculators.qmmm import (SimpleQMMM, EIQMMM, LJInteractions,
-                                  LJInteractionsGeneral)
+                                  LJInteractionsGeneral, Embedding, wrap,
+                                  _lj_general_kernel)
 from ase.constraints import FixInternals
 from ase.optimize import GPMin
 
 
+def make_water():
+    """Water molecule with the O atom at the origin."""
+    return Atoms('OH2', [(0, 0, 0), (0.96, 0, 0), (-0.24, 0.93, 0)])
+
+
+def make_dimer(z=0.0, dy=0.0):
+    """TIP3P water dimer with the second molecule at height z.
+
+    dy moves the first H atom of the second molecule out of symmetry."""
+    r = rOH
+    a = angleHOH * pi / 180
+    return Atoms('H2OH2O',
+                 [(r * cos(a), 0, r * sin(a)),
+                  (r, 0, 0),
+                  (0, 0, 0),
+                  (r * cos(a / 2), r * sin(a / 2) + dy, z),
+                  (r * cos(a / 2), -r * sin(a / 2), z),
+                  (0, 0, z)])
+
+
+def test_wrap():
+    rng = np.random.RandomState(42)
+    cell = np.array([3.0, 4.0, 5.0])
+    D0 = rng.uniform(-20, 20, (50, 3))
+    for pbc in [(True, False, True), (True, True, True)]:
+        D = D0.copy()
+        wrap(D, cell, pbc)
+        p = np.array(pbc)
+        assert np.all(abs(D[:, p]) <= cell[p] / 2)
+        assert np.all(D[:, ~p] == D0[:, ~p])
+        # Only whole cell vectors were subtracted:
+        n = (D0 - D) / cell
+        assert np.allclose(n, np.round(n))
+
+
+def test_lj_general_cutoff():
+    """Check LJ-general forces numerically for several QM molecules."""
+    rng = np.random.RandomState(7)
+    water = make_water()
+    qmatoms = Atoms(cell=[8, 8, 8])
+    for x in [2.5, 5.5]:
+        mol = water.copy()
+        mol.translate((x, 4, 4))
+        qmatoms += mol
+    mmatoms = Atoms(pbc=True, cell=[12, 12, 12])
+    for x in [0, 4, 8]:
+        for y in [1, 7]:
+            for z in [1, 7]:
+                mol = water.copy()
+                mol.rotate(rng.uniform(0, 360), rng.uniform(-1, 1, 3))
+                mol.translate(rng.uniform(-0.5, 0.5, 3) + (x, y, z))
+                mmatoms += mol
+
+    sigma = np.array([sigma0, 1.0, 1.0])
+    epsilon = np.array([epsilon0, 0.001, 0.0])
+    lj = LJInteractionsGeneral(sigma, epsilon, sigma, epsilon, 3,
+                               rc=5.0, width=1.5)
+    shift = np.array([0.3, -0.2, 0.1])
+
+    energy, qmforces, mmforces = lj.calculate(qmatoms, mmatoms, shift)
+    assert abs(qmforces.sum(0) + mmforces.sum(0)).max() < 1e-10
+
+    h = 1e-6
+    for atoms, forces in [(qmatoms, qmforces), (mmatoms, mmforces)]:
+        for a in range(len(atoms)):
+            for c in range(3):
+                e = []
+                for d in [h, -h]:
+                    atoms.positions[a, c] += d
+                    e.append(lj.calculate(qmatoms, mmatoms, shift)[0])
+                    atoms.positions[a, c] -= d
+                assert abs(forces[a, c] + (e[0] - e[1]) / (2 * h)) < 1e-6
+
+    # Single precision pair interactions:
+    lj32 = LJInteractionsGeneral(sigma, epsilon, sigma, epsilon, 3,
+                                 rc=5.0, width=1.5, dtype=np.float32)
+    energy32, qmforces32, mmforces32 = lj32.calculate(qmatoms, mmatoms, shift)
+    assert isinstance(energy32, float)
+    assert qmforces32.dtype == mmforces32.dtype == np.float64
+    assert abs(energy32 - energy) < 1e-5 * abs(energy)
+    assert abs(qmforces32 - qmforces).max() < 1e-5
+    assert abs(mmforces32 - mmforces).max() < 1e-5
+    assert abs(qmforces32.sum(0) + mmforces32.sum(0)).max() < 1e-10
+
+    # No LJ parameters at all on the QM side:
+    lj0 = LJInteractionsGeneral(sigma, np.zeros(3), sigma, epsilon, 3,
+                                rc=5.0, width=1.5)
+    energy0, qmforces0, mmforces0 = lj0.calculate(qmatoms, mmatoms, shift)
+    assert energy0 == 0.0
+    assert not qmforces0.any() and not mmforces0.any()
+
+
+def test_lj_general_blocks():
+    """Blocks of QM molecules or atoms must not change the results."""
+    rng = np.random.RandomState(3)
+    qmpositions = rng.uniform(0, 6, (4, 5, 3))
+    mmpositions = rng.uniform(-6, 12, (30, 3, 3))
+    sigma6 = rng.uniform(1, 2, (5, 3))**6
+    epsilon = rng.uniform(0, 0.01, (5, 3))
+    epsilon[2] = 0.0
+    ref = _lj_general_kernel(qmpositions, mmpositions, sigma6, epsilon,
+                             np.inf, 1.0)
+    # Two molecules per block, then two atoms of one molecule per block:
+    for maxpairs in [2 * 4 * 90, 2 * 90]:
+        energy, qmforces, mmforces = _lj_general_kernel(
+            qmpositions, mmpositions, sigma6, epsilon, np.inf, 1.0,
+            maxpairs=maxpairs)
+        assert energy == pytest.approx(ref[0], rel=1e-12)
+        assert qmforces == pytest.approx(ref[1], rel=1e-10, abs=1e-14)
+        assert mmforces == pytest.approx(ref[2], rel=1e-10, abs=1e-14)
+
+
+def test_lj_general_float32_offset():
+    """Single precision must not get worse far from the origin."""
+    rng = np.random.RandomState(1)
+    sigma = np.array([sigma0, 1.0, 1.0])
+    epsilon = np.array([epsilon0, 0.001, 0.0005])
+    errors = []
+    for offset in [0.0, 1e4]:
+        # The MM molecules are wrapped around the center of the QM cell:
+        qmatoms = make_water()
+        qmatoms.cell = [8 + 2 * offset] * 3
+        qmatoms.center()
+        mmatoms = Atoms('OH2' * 50, rng.uniform(offset, offset + 12, (150, 3)),
+                        pbc=True, cell=[12, 12, 12])
+        forces = []
+        for dtype in [float, np.float32]:
+            lj = LJInteractionsGeneral(sigma, epsilon, sigma, epsilon, 3,
+                                       rc=5.0, width=1.0, dtype=dtype)
+            forces.append(lj.calculate(qmatoms, mmatoms, np.zeros(3))[1])
+        errors.append(abs(forces[1] - forces[0]).max() /
+                      abs(forces[0]).max())
+    assert errors[1] < 1e-6
+    assert errors[1] < 10 * errors[0]
+
+
+class PointCharges:
+    def set_positions(self, positions, com_pv=None):
+        self.positions = positions.copy()
+        self.com_pv = com_pv.copy()
+
+
+class EmbeddingTIP3P(TIP3P):
+    def embed(self, charges, **parameters):
+        return PointCharges()
+
+
+def test_embedding_update():
+    rng = np.random.RandomState(17)
+    water = make_water()
+    qmatoms = water.copy()
+    qmatoms.cell = [6, 6, 6]
+    qmatoms.center()
+    mmatoms = Atoms(pbc=True, cell=[8, 9, 10])
+    for i in range(4):
+        mol = water.copy()
+        mol.translate(rng.uniform(0, 10, 3))
+        mmatoms += mol
+    qmatoms.calc = EmbeddingTIP3P()
+    mmatoms.calc = TIP3P()
+
+    embedding = Embedding(rc2=10.0)
+    embedding.initialize(qmatoms, mmatoms)
+    qmcenter = qmatoms.positions.mean(axis=0)
+    for step in range(2):
+        mmatoms.positions += 0.1
+        embedding.update(np.zeros(3))
+        pcpot = embedding.pcpot
+        positions = pcpot.positions.reshape((-1, 3, 3))
+        # Molecules are moved as a whole by whole cell vectors:
+        n = (positions - mmatoms.positions.reshape((-1, 3, 3))) / [8, 9, 10]
+        assert np.allclose(n, np.round(n))
+        assert np.allclose(n, n[:, :1])
+        assert np.all(abs(positions[:, 0] - qmcenter) <= [4, 4.5, 5])
+        com = positions.mean(axis=1)
+        assert np.allclose(pcpot.com_pv, np.repeat(com, 3, axis=0))
+
+
+def test_simpleqmmm_parallel():
+    dimer = make_dimer(z=2.8, dy=0.1)
+    results = []
+    for parallel in [False, True]:
+        dimer.calc = SimpleQMMM([0, 1, 2], TIP3P(), TIP3P(), TIP3P(),
+                                vacuum=3.0, parallel=parallel)
+        results.append((dimer.get_potential_energy(), dimer.get_forces()))
+    assert results[0][0] == pytest.approx(results[1][0], abs=1e-12)
+    assert results[0][1] == pytest.approx(results[1][1], abs=1e-12)
+
+    # A shared calculator would be run from two threads at once:
+    mmcalc = TIP3P()
+    with pytest.raises(ValueError):
+        SimpleQMMM([0, 1, 2], TIP3P(), mmcalc, mmcalc, parallel=True)
+
+    # ... and so would files written with the same label:
+    with pytest.raises(ValueError):
+        SimpleQMMM([0, 1, 2], TIP3P(), FileIOCalculator(label='mm'),
+                   FileIOCalculator(label='mm'), parallel=True)
+    SimpleQMMM([0, 1, 2], TIP3P(), FileIOCalculator(label='mm1'),
+               FileIOCalculator(label='mm2'), parallel=True)
+
+
+def test_eiqmmm_output():
+    dimer = make_dimer(z=2.8)
+    lj = LJInteractions({('O', 'O'): (epsilon0, sigma0)})
+
+    calc = EIQMMM([0, 1, 2], TIP3P(), TIP3P(), lj)
+    assert calc.output is None
+    dimer.calc = calc
+    energy = dimer.get_potential_energy()
+
+    output = StringIO()
+    dimer.calc = EIQMMM([0, 1, 2], TIP3P(), TIP3P(), lj, vacuum=3.0,
+                        output=output)
+    assert dimer.get_potential_energy() == pytest.approx(energy)
+    log = output.getvalue()
+    assert 'Size of QM-cell after centering:' in log
+    assert 'Embedding:' in log
+    assert 'Energies:' in log
+
+
 def test_qmmm(testdir):
     r = rOH
     a = angleHOH * pi / 180
@@ -40,13 +264,7 @@ def test_qmmm(testdir):
                  EIQMMM([0, 1, 2], TIP3P(), TIP3P(), ig),
                  EIQMMM([3, 4, 5], TIP3P(), TIP3P(), ig, vacuum=3.0),
                  EIQMMM([0, 1, 2], TIP3P(), TIP3P(), ig, vacuum=3.0)]:
-        dimer = Atoms('H2OH2O',
-                      [(r * cos(a), 0, r * sin(a)),
-                       (r, 0, 0),
-                       (0, 0, 0),
-                       (r * cos(a / 2), r * sin(a / 2), 0),
-                       (r * cos(a / 2), -r * sin(a / 2), 0),
-                       (0, 0, 0)])
+        dimer = make_dimer()
         dimer.calc = calc
 
         E = []